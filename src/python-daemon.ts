@@ -381,6 +381,10 @@ build-backend = "hatchling.build"
     return this.request('post', '/cast', payload);
   }
 
+  async castSpells(items: { spellId: string, scriptFile?: string, script?: string, input?: string }[]): Promise<any[]> {
+    return this.request('post', '/cast_batch', { items });
+  }
+
   async listSpells(): Promise<any> {
     return this.request('get', '/spells');
   }
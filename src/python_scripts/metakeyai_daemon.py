@@ -6,30 +6,75 @@ MetaKeyAI background Python daemon
 - Retains in-memory caching of spell modules for performance.
 """
 
+import asyncio
+import hashlib
+import itertools
 import json
 import sys
 import time
 import types
-import runpy
 import importlib.util
-import traceback
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 import os
 import io
-import tempfile
-import uuid
-from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, HTTPException
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 
+# orjson serializes responses in C; fall back to the stdlib encoder without it
+try:
+    import orjson
+    _json_bytes = orjson.dumps
+except ImportError:
+    def _json_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when available.
+
+    Used instead of fastapi's ORJSONResponse, which newer FastAPI releases
+    deprecate and which hard-fails without orjson installed.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return _json_bytes(content)
+
 # ---------------------------------------------------------------------------
 # Constants and Globals
 # ---------------------------------------------------------------------------
 PORT = int(os.getenv("METAKEYAI_PORT", "5000"))
-SPELL_CACHE: Dict[str, types.ModuleType] = {}
+# Upper bound on spells executing at once; extra casts wait instead of piling onto the threadpool
+MAX_CONCURRENT_CASTS = max(1, int(os.getenv("METAKEYAI_MAX_CONCURRENT_CASTS", "4")))
+# Last known METAKEYAI_LLM, kept in sync by _configure_llm_from_env and /env
+_CURRENT_MODEL: Optional[str] = os.getenv("METAKEYAI_LLM")
+# Threads behind asyncio.to_thread (spell casts, LM calls, first DSPy import)
+THREADPOOL_SIZE = max(1, int(os.getenv("METAKEYAI_THREADPOOL_SIZE", str(MAX_CONCURRENT_CASTS + 4))))
+# Uvicorn worker processes; each worker has its own registry, caches and /env state
+WORKERS = max(1, int(os.getenv("METAKEYAI_WORKERS", "1")))
+# A loaded spell module and its main() entry point (None for print-style scripts)
+SpellEntry = Tuple[types.ModuleType, Optional[Callable[[str], Any]]]
+# Loaded spells keyed by absolute path -> (st_mtime_ns, SpellEntry), LRU-bounded
+MAX_CACHED_SPELLS = 256
+SPELL_CACHE: "OrderedDict[str, Tuple[int, SpellEntry]]" = OrderedDict()
+_SPELL_CACHE_LOCK = threading.Lock()
+# script_file as given by callers -> interned SPELL_CACHE key
+_SPELL_KEYS: Dict[str, str] = {}
+_SPELL_NAME_SEQ = itertools.count()
+# Compiled spell code keyed by path -> (st_mtime_ns, code) for main()-less spells
+_CODE_CACHE: Dict[str, Tuple[int, types.CodeType]] = {}
+# Inline scripts keyed by blake2b digest of their source -> (code, main), LRU-bounded.
+# main is filled in once a script is seen to define one, so later casts skip exec.
+MAX_CACHED_INLINE = 128
+_INLINE_CACHE: "OrderedDict[str, Tuple[types.CodeType, Optional[Callable[[str], Any]]]]" = OrderedDict()
+_INLINE_LOCK = threading.Lock()
 
 # ---------------------------------------------------------------------------
 # Helpers (logging to stderr)
@@ -39,74 +84,140 @@ def log(*args, **kwargs):
     """Print to stderr so stdout stays clean for server logs."""
     print(*args, file=sys.stderr, **kwargs)
 
-# ---------------------------------------------------------------------------
-# LLM / ENV management
-# ---------------------------------------------------------------------------
+class _ThreadLocalStream:
+    """Stand-in for sys.stdin/sys.stdout that routes I/O per thread.
 
-# Import dspy and configure it properly
-dspy = None
-dspy_error = None
+    Spells run concurrently in worker threads, so swapping the process-wide
+    stream (directly or via contextlib.redirect_stdout) would let their
+    captures interleave. The proxy is installed once; each thread can then
+    point it at its own buffer with ``redirect()``.
+    """
 
-try:
-    import dspy
-    log("✅ dspy-ai package found.")
-    
-    # Configure DSPy immediately with environment model if available
-    model_name = os.getenv("METAKEYAI_LLM")
-    if model_name:
-        try:
-            log(f"🔧 Configuring DSPy with model: {model_name}")
-            dspy.configure(lm=dspy.LM(model_name))
-            log("✅ DSPy configured successfully")
-        except Exception as e:
-            log(f"⚠️ DSPy configuration failed: {e}")
-    else:
-        log("⚠️ No METAKEYAI_LLM environment variable set")
-        
-except ImportError as e:
-    dspy_error = str(e)
-    log("⚠️ dspy-ai package not found. AI features will be limited.")
-    log(f"Import error: {dspy_error}")
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
 
-def load_spell_module(script_file: str) -> types.ModuleType:
-    """Load (and cache) a spell module from arbitrary path."""
-    script_path = Path(script_file).resolve()
-    if not script_path.exists():
-        raise FileNotFoundError(f"spell script not found: {script_path}")
+    def __getattr__(self, name):
+        stream = getattr(self._local, "stream", None)
+        return getattr(self._default if stream is None else stream, name)
 
-    module_name = f"metakeyai_spell_{script_path.stem}_{abs(hash(str(script_path)))}"
+    @contextmanager
+    def redirect(self, stream):
+        """Route this thread's I/O to ``stream`` (no-op when ``None``)."""
+        previous = getattr(self._local, "stream", None)
+        self._local.stream = previous if stream is None else stream
+        try:
+            yield stream
+        finally:
+            self._local.stream = previous
 
-    if module_name in sys.modules:
-        return sys.modules[module_name]
+sys.stdin = _STDIN = _ThreadLocalStream(sys.stdin)
+sys.stdout = _STDOUT = _ThreadLocalStream(sys.stdout)
 
-    spec = importlib.util.spec_from_file_location(module_name, str(script_path))
-    if spec is None or spec.loader is None:  # type: ignore
-        raise ImportError(f"cannot import spell module from {script_path}")
+class _ThreadLocalModule(types.ModuleType):
+    """sys.modules entry that resolves to the module each thread is running.
 
-    module = importlib.util.module_from_spec(spec)  # type: ignore
-    # Provide dspy to spell namespace (already configured globally)
-    if dspy:
-        module.__dict__['dspy'] = dspy
+    Print-style spells all execute as ``__spell__``; dataclasses, pickle and
+    forward references look their module up by that name, so it has to exist
+    while the spell runs, and concurrent spells must each see their own.
+    """
 
-    sys.modules[module_name] = module
-    spec.loader.exec_module(module)  # type: ignore
-    return module
+    def __init__(self, name):
+        super().__init__(name)
+        object.__setattr__(self, "_local", threading.local())
+
+    @property
+    def __dict__(self):
+        module = getattr(self._local, "module", None)
+        return {} if module is None else module.__dict__
+
+    def __getattr__(self, name):
+        module = getattr(self._local, "module", None)
+        if module is None:
+            raise AttributeError(name)
+        return getattr(module, name)
+
+    @contextmanager
+    def running(self, module):
+        """Resolve this name to ``module`` on the current thread."""
+        previous = getattr(self._local, "module", None)
+        self._local.module = module
+        try:
+            yield module
+        finally:
+            self._local.module = previous
 
 # ---------------------------------------------------------------------------
 # LLM / ENV management
 # ---------------------------------------------------------------------------
 
+# DSPy is heavy to import, so it is loaded and configured on first use only.
+# DSPY_AVAILABLE is a cheap check that does not import it.
+DSPY_AVAILABLE = importlib.util.find_spec("dspy") is not None
+dspy = None
+dspy_error = None if DSPY_AVAILABLE else "No module named 'dspy'"
+_DSPY_LOADED = False
+_DSPY_LOCK = threading.Lock()
+
+def _get_dspy():
+    """Import and configure DSPy once, returning the module (or None)."""
+    global dspy, dspy_error, _DSPY_LOADED
+    if _DSPY_LOADED:
+        return dspy
+    with _DSPY_LOCK:
+        if not _DSPY_LOADED:
+            try:
+                import dspy
+                log("✅ dspy-ai package found.")
+                _configure_llm_from_env()
+            except ImportError as e:
+                dspy_error = str(e)
+                log("⚠️ dspy-ai package not found. AI features will be limited.")
+                log(f"Import error: {dspy_error}")
+            _DSPY_LOADED = True
+    return dspy
+
+async def _aget_dspy():
+    """_get_dspy() for request handlers; the first import runs off the event loop."""
+    return dspy if _DSPY_LOADED else await asyncio.to_thread(_get_dspy)
+
+class _LazyDspy(types.ModuleType):
+    """Stand-in for ``dspy`` in spell namespaces that loads it on first attribute use."""
+
+    def __getattr__(self, name):
+        return getattr(_get_dspy(), name)
+
+_LAZY_DSPY = _LazyDspy("dspy") if DSPY_AVAILABLE else None
+
+def _ensure_dspy_for(code: Optional[types.CodeType] = None):
+    """Load DSPy before running a spell that imports it directly.
+
+    Injected ``dspy`` names are lazy already, but a spell's own ``import dspy``
+    would bypass configuration, so load it when the spell (anywhere in its
+    code, including function bodies) or anything before it references dspy.
+    """
+    if not _DSPY_LOADED and DSPY_AVAILABLE and (
+            "dspy" in sys.modules or (code is not None and _references_dspy(code))):
+        _get_dspy()
+
+def _references_dspy(code: types.CodeType) -> bool:
+    """Whether ``code`` or any function/class body nested in it names dspy."""
+    return "dspy" in code.co_names or any(
+        isinstance(const, types.CodeType) and _references_dspy(const)
+        for const in code.co_consts)
+
 def _configure_llm_from_env():
     """Configure DSPy default LLM from environment vars.
     
-    IMPORTANT: This should only be called ONCE during startup due to DSPy's
+    IMPORTANT: This should only be called ONCE (from _get_dspy) due to DSPy's
     thread restrictions. DSPy doesn't allow reconfiguration from different threads.
     """
+    global _CURRENT_MODEL
     if not dspy:
         log("❌ Cannot configure LLM - DSPy not available")
         return False
         
-    model_name = os.getenv("METAKEYAI_LLM")
+    model_name = _CURRENT_MODEL = os.getenv("METAKEYAI_LLM")
     if not model_name:
         log("⚠️ No METAKEYAI_LLM environment variable set")
         return False
@@ -120,27 +231,179 @@ def _configure_llm_from_env():
         log(f"❌ Failed to configure DSPy LLM: {e}")
         return False
 
+# ---------------------------------------------------------------------------
+# Spell Loading
+# ---------------------------------------------------------------------------
+
+def load_spell_module(script_file: str) -> types.ModuleType:
+    """Load (and cache) a spell module from arbitrary path."""
+    return load_spell_entry(script_file)[0]
+
+def load_spell_entry(script_file: str, input_text: str = "") -> SpellEntry:
+    """Load (and cache) a spell from arbitrary path as (module, main).
+
+    The cache is keyed on the absolute path and reloads the module when the
+    file's mtime changes, so edited spells are picked up without a restart.
+    Modules are registered in sys.modules (dataclasses, pickle and forward
+    references look them up there) for as long as SPELL_CACHE holds them;
+    it evicts the least recently used entry past MAX_CACHED_SPELLS.
+
+    Loading runs the spell's top-level code, so it reads ``input_text`` as
+    stdin (never the daemon's own, which the parent keeps open) and anything
+    it prints is discarded.
+    """
+    try:
+        mtime = os.stat(script_file).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"spell script not found: {script_file}")
+
+    # abspath (not realpath) keeps the hit path to this one stat() call; callers
+    # repeat the same path strings, so their keys are remembered too
+    key = _SPELL_KEYS.get(script_file)
+    if key is None:
+        if len(_SPELL_KEYS) >= 4 * MAX_CACHED_SPELLS:
+            _SPELL_KEYS.clear()
+        key = _SPELL_KEYS[script_file] = sys.intern(os.path.abspath(script_file))
+    with _SPELL_CACHE_LOCK:
+        cached = SPELL_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            SPELL_CACHE.move_to_end(key)
+            return cached[1]
+
+    # A fresh name per load, so a reload never clobbers a module still in use
+    module_name = f"metakeyai_spell_{Path(key).stem}_{next(_SPELL_NAME_SEQ)}"
+
+    if key.startswith(_SPELLS_DIR_PREFIX):
+        # Bundled spells are trusted flat files: skip the importer machinery and
+        # share the compiled code with _compile_spell
+        module = types.ModuleType(module_name)
+        module.__file__ = key
+        spec = None
+    else:
+        spec = importlib.util.spec_from_file_location(module_name, key)
+        if spec is None or spec.loader is None:  # type: ignore
+            raise ImportError(f"cannot import spell module from {key}")
+        module = importlib.util.module_from_spec(spec)  # type: ignore
+
+    # Provide dspy to spell namespace (loaded and configured on first use)
+    if DSPY_AVAILABLE:
+        module.__dict__['dspy'] = _LAZY_DSPY
+
+    # The top-level code may import dspy itself; configure it first. The
+    # compiled code is cached, so the print-style exec path reuses it.
+    code = _compile_spell(key, mtime)
+    _ensure_dspy_for(code)
+
+    sys.modules[module_name] = module
+    try:
+        with _STDIN.redirect(io.StringIO(input_text)), _STDOUT.redirect(io.StringIO()):
+            if spec is None:
+                exec(code, module.__dict__)
+            else:
+                spec.loader.exec_module(module)  # type: ignore
+    except BaseException:
+        sys.modules.pop(module_name, None)
+        raise
+    entry = (module, module.__dict__.get("main"))
+    with _SPELL_CACHE_LOCK:
+        # Replaces any stale entry for this path, then trims the oldest;
+        # dropped modules leave sys.modules with them
+        stale = SPELL_CACHE.get(key)
+        SPELL_CACHE[key] = (mtime, entry)
+        SPELL_CACHE.move_to_end(key)
+        if len(SPELL_CACHE) > MAX_CACHED_SPELLS:
+            _, evicted = SPELL_CACHE.popitem(last=False)
+            sys.modules.pop(evicted[1][0].__name__, None)
+        if stale is not None:
+            sys.modules.pop(stale[1][0].__name__, None)
+    return entry
+
+def _compile_spell(script_file: str, mtime: Optional[int] = None) -> types.CodeType:
+    """Return the compiled code for a script, recompiling only when it changes."""
+    if mtime is None:
+        mtime = os.stat(script_file).st_mtime_ns
+    cached = _CODE_CACHE.get(script_file)
+    if cached is None or cached[0] != mtime:
+        src = Path(script_file).read_bytes()
+        cached = _CODE_CACHE[script_file] = (mtime, compile(src, script_file, "exec"))
+    return cached[1]
+
+def _compile_inline(source: str, filename: str):
+    """Compile inline spell source in memory, reusing it for repeated sources.
+
+    Returns (key, code, main) where main is the script's cached entry point,
+    if any. The digest is far cheaper than compile() and, unlike keying on
+    the source itself, does not keep every script's full text alive.
+    """
+    key = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+    with _INLINE_LOCK:
+        entry = _INLINE_CACHE.get(key)
+        if entry is not None:
+            _INLINE_CACHE.move_to_end(key)
+            return (key, *entry)
+    code = compile(source, filename, "exec")
+    with _INLINE_LOCK:
+        _INLINE_CACHE[key] = (code, None)
+        if len(_INLINE_CACHE) > MAX_CACHED_INLINE:
+            _INLINE_CACHE.popitem(last=False)
+    return key, code, None
+
+def _remember_inline_main(key: str, code: types.CodeType, main: Callable[[str], Any]):
+    """Keep an inline script's main() so its top-level code runs only once."""
+    with _INLINE_LOCK:
+        if key in _INLINE_CACHE:
+            _INLINE_CACHE[key] = (code, main)
+
 # ---------------------------------------------------------------------------
 # Spell Discovery
 # ---------------------------------------------------------------------------
 
 SPELLS_DIR = Path(__file__).parent / "spells"
+_SPELLS_DIR_PREFIX = os.path.join(os.path.abspath(SPELLS_DIR), "")
 SPELL_REGISTRY: Dict[str, Dict[str, Any]] = {}
+# Pre-serialized /spells body, rebuilt whenever discovery changes the registry
+_SPELLS_JSON: bytes = b"[]"
+
+def _load_one(py_file: str):
+    """Load a single spell file, returning its META or None on failure.
+
+    The loaded entry stays in SPELL_CACHE, so the first cast is a cache hit.
+    """
+    try:
+        return getattr(load_spell_module(py_file), "META", {})
+    except Exception as e:
+        log(f"Failed to load spell {py_file}: {e}")
+        return None
 
 def _discover_spells():
-    """Scan the spells directory and load META info."""
-    if not SPELLS_DIR.exists():
+    """Scan the spells directory and load META info.
+
+    Spell files are loaded concurrently (their top-level code is often
+    I/O bound on heavy imports); the registry is filled afterwards on the
+    calling thread, in file order.
+    """
+    global _SPELLS_JSON
+    # scandir yields type info with the listing, avoiding a stat and a Path per entry
+    try:
+        with os.scandir(SPELLS_DIR) as it:
+            files = sorted(e.path for e in it
+                           if e.name.endswith(".py") and e.name != "__init__.py" and e.is_file())
+    except FileNotFoundError:
         return
-    for py_file in sorted(SPELLS_DIR.glob("*.py")):
-        if py_file.stem == "__init__":
-            continue
-        try:
-            mod = load_spell_module(str(py_file))
-            meta = getattr(mod, "META", {})
-            if "id" in meta:
-                SPELL_REGISTRY[meta["id"]] = {**meta, "scriptFile": str(py_file)}
-        except Exception as e:
-            log(f"Failed to load spell {py_file}: {e}")
+    if not files:
+        return
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1, len(files))) as pool:
+        loaded = list(pool.map(_load_one, files))
+    for py_file, meta in zip(files, loaded):
+        if meta is not None and "id" in meta:
+            # Encoded up front (sets, Paths, ...) so the /spells body below
+            # cannot fail on a single spell
+            try:
+                SPELL_REGISTRY[meta["id"]] = jsonable_encoder({**meta, "scriptFile": py_file})
+            except Exception as e:
+                log(f"Skipping spell {py_file}: META is not JSON-serializable: {e}")
+    # Swapped in one assignment so /spells never sees a partial body
+    _SPELLS_JSON = _json_bytes(list(SPELL_REGISTRY.values()))
 
 # ---------------------------------------------------------------------------
 # FastAPI App and Endpoints
@@ -152,24 +415,19 @@ def _discover_spells():
 async def lifespan(app: FastAPI):
     """Server startup logic."""
     log("🚀 FastAPI server starting up...")
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADPOOL_SIZE, thread_name_prefix="metakeyai"))
     
     # Log current environment
     model_name = os.getenv("METAKEYAI_LLM")
     log(f"🔧 Environment METAKEYAI_LLM: {model_name}")
     
     try:
-        # Configure DSPy if not already done and environment is available
-        if dspy and model_name:
-            success = _configure_llm_from_env()
-            if success:
-                log("✅ DSPy configured successfully on startup")
-            else:
-                log("⚠️ DSPy configuration failed on startup")
-        elif not dspy:
-            log("⚠️ DSPy not available - AI features disabled")
+        if DSPY_AVAILABLE:
+            log("🔧 DSPy will be loaded and configured on first use")
         else:
-            log("⚠️ No METAKEYAI_LLM set - DSPy not configured")
-            
+            log("⚠️ DSPy not available - AI features disabled")
+
         _discover_spells()
         log("✅ Spells discovered and loaded.")
         log(f"📡 API docs available at: http://127.0.0.1:{PORT}/docs")
@@ -181,12 +439,16 @@ async def lifespan(app: FastAPI):
     # Code below runs on shutdown
     log("🔌 FastAPI server shutting down.")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Fields of /health that cannot change while the process runs
+_HEALTH_STATIC = {"status": "ok", "version": "1.0.0", "dspy_available": DSPY_AVAILABLE, "port": PORT}
 
 @app.get("/health")
-def health_check():
-    # Check DSPy configuration status
-    dspy_configured = False
+async def health_check():
+    # Check DSPy configuration status; before DSPy is first loaded, report
+    # whether it will be configured on that first use
+    dspy_configured = DSPY_AVAILABLE and _CURRENT_MODEL is not None and not _DSPY_LOADED
     if dspy:
         try:
             dspy_configured = hasattr(dspy.settings, 'lm') and dspy.settings.lm is not None
@@ -194,18 +456,20 @@ def health_check():
             pass
     
     return {
-        "status": "ok", 
-        "version": "1.0.0", 
-        "dspy_available": bool(dspy),
+        **_HEALTH_STATIC,
         "dspy_configured": dspy_configured,
-        "model": os.getenv("METAKEYAI_LLM", "not_set"),
-        "port": PORT
+        "model": "not_set" if _CURRENT_MODEL is None else _CURRENT_MODEL,
     }
 
-@app.get("/ping")
-def ping():
+@app.get("/ping", response_class=PlainTextResponse)
+async def ping():
     return "pong"
 
+# Globals shared by every exec'd spell; each cast copies them into a fresh namespace
+_SPELL_GLOBALS = types.MappingProxyType({"__name__": "__spell__", "dspy": _LAZY_DSPY, "sys": sys})
+# Registered once, as runpy registered a temporary module per run
+sys.modules["__spell__"] = _SPELL_MODULE = _ThreadLocalModule("__spell__")
+
 class SpellCastRequest(BaseModel):
     spellId: str
     # Allow either a script file or inline script content
@@ -213,80 +477,154 @@ class SpellCastRequest(BaseModel):
     script: Optional[str] = None
     input: Optional[str] = ""
 
+def _call_main(main: Callable[[str], Any], input_text: str) -> Any:
+    """Call a spell's main(); it returns its result, so only stdin is redirected."""
+    with _STDIN.redirect(io.StringIO(input_text or "")):
+        return main(input_text)
+
+def _execute_spell(spell_id: str, input_text: str,
+                   script_file: Optional[str] = None, script: Optional[str] = None):
+    """Run a spell synchronously and return (result, success, error_msg).
+
+    Called through ``asyncio.to_thread`` so the event loop stays free while
+    the spell runs; spells therefore execute in the default threadpool and
+    concurrency can be bounded with a semaphore around the call.
+    """
+    try:
+        if script is not None:
+            key, code, main = _compile_inline(script, f"<spell:{spell_id}>")
+            if main is not None:
+                _ensure_dspy_for(code)
+                return _call_main(main, input_text), True, None
+        else:
+            mod, main = load_spell_entry(script_file, input_text or "")
+            if main is not None:
+                _ensure_dspy_for()
+                return _call_main(main, input_text), True, None
+            code = _compile_spell(mod.__file__)
+
+        _ensure_dspy_for(code)
+        module = types.ModuleType("__spell__")
+        ns = module.__dict__
+        ns.update(_SPELL_GLOBALS, __file__=code.co_filename, INPUT_TEXT=input_text)
+        # Empty input still gets its own stdin; the daemon's is the parent's open pipe
+        with _STDIN.redirect(io.StringIO(input_text or "")), _SPELL_MODULE.running(module), \
+                _STDOUT.redirect(io.StringIO()) as captured_stdout:
+            exec(code, ns)
+        main = ns.get("main")
+        if not callable(main):
+            return captured_stdout.getvalue(), True, None
+        if script is not None:
+            _remember_inline_main(key, code, main)
+        return _call_main(main, input_text), True, None
+    except Exception as e:
+        log("Spell execution failed:", e)
+        return "", False, str(e)
+
+_CAST_SEMA = asyncio.Semaphore(MAX_CONCURRENT_CASTS)
+
+async def _cast(payload: SpellCastRequest) -> Dict[str, Any]:
+    """Run one cast under the concurrency limit and build its response."""
+    # Inline script content is compiled in memory, never written to disk
+    # Registered spells may be cast by id alone; they still go through
+    # load_spell_entry, so edits on disk are picked up like any other file
+    script_file = payload.scriptFile
+    if not script_file and not payload.script and payload.spellId in SPELL_REGISTRY:
+        script_file = SPELL_REGISTRY[payload.spellId]["scriptFile"]
+    if not script_file and not payload.script:
+        raise ValueError(f"No scriptFile or script content provided for spell {payload.spellId}")
+
+    # Spell failures are reported in the body by _execute_spell
+    start = time.time()
+    async with _CAST_SEMA:
+        result, success, error_msg = await asyncio.to_thread(
+            _execute_spell, payload.spellId, payload.input,
+            script_file=script_file, script=payload.script or None,
+        )
+
+    return {
+        "spellId": payload.spellId,
+        "success": success,
+        "output": result,
+        "executionTime": int((time.time() - start) * 1000),
+        "error": error_msg,
+    }
+
 @app.post("/cast")
-def cast_spell(payload: SpellCastRequest):
+async def cast_spell(payload: SpellCastRequest):
     try:
-        script_to_run = payload.scriptFile
-        temp_file_path = None
-
-        # If inline script content is provided, write it to a temporary file
-        if payload.script:
-            temp_file_path = Path(tempfile.gettempdir()) / f"metakeyai_temp_spell_{uuid.uuid4()}.py"
-            with open(temp_file_path, "w", encoding="utf-8") as f:
-                f.write(payload.script)
-            script_to_run = str(temp_file_path)
-
-        if not script_to_run:
-            raise ValueError(f"No scriptFile or script content provided for spell {payload.spellId}")
-
-        input_text = payload.input
-
-        start = time.time()
-        original_stdin = sys.stdin
-        original_stdout = sys.stdout
-        if input_text:
-            sys.stdin = io.StringIO(input_text)
-        
-        sys.stdout = captured_stdout = io.StringIO()
+        return await _cast(payload)
+    except ValueError as e:
+        log(f"Error casting spell: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
+class BatchCastRequest(BaseModel):
+    items: List[SpellCastRequest]
+
+@app.post("/cast_batch")
+async def cast_batch(payload: BatchCastRequest):
+    """Cast several spells concurrently, returning results in request order.
+
+    Each item gets the same response shape as /cast; invalid items fail on
+    their own instead of failing the batch.
+    """
+    async def cast_one(item: SpellCastRequest) -> Dict[str, Any]:
         try:
-            mod = load_spell_module(script_to_run)
-            if hasattr(mod, "main"):
-                result = mod.main(input_text)
-            else:
-                ns = {"__name__": "__spell__", "INPUT_TEXT": input_text, "dspy": dspy, "sys": sys}
-                runpy.run_path(script_to_run, init_globals=ns)
-                result = captured_stdout.getvalue()
-            success = True
-            error_msg = None
-        except Exception as e:
-            log("Spell execution failed:", e)
-            result = ""
-            success = False
-            error_msg = str(e)
-        finally:
-            sys.stdin = original_stdin
-            sys.stdout = original_stdout
-            # Clean up the temporary file if one was created
-            if temp_file_path:
-                os.remove(temp_file_path)
-
-        return {
-            "spellId": payload.spellId,
-            "success": success,
-            "output": result,
-            "executionTime": int((time.time() - start) * 1000),
-            "error": error_msg,
-        }
-    except Exception as e:
-        log(f"Error casting spell: {e}\n{traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=str(e))
+            return await _cast(item)
+        except ValueError as e:
+            return {"spellId": item.spellId, "success": False, "output": "",
+                    "executionTime": 0, "error": str(e)}
+
+    return await asyncio.gather(*(cast_one(item) for item in payload.items))
 
 @app.get("/spells")
-def list_spells():
-    return list(SPELL_REGISTRY.values())
+async def list_spells():
+    return Response(_SPELLS_JSON, media_type="application/json")
 
 class EnvUpdateRequest(BaseModel):
     env: Dict[str, str]
+    # Opt-in live LLM round-trip to check the configured model and key
+    probe: bool = False
+
+PROBE_TTL = 60.0
+PROBE_TIMEOUT = 3.0
+# (probed LM's model or id, OPENAI_API_KEY) -> (ok, error, monotonic time of the probe)
+_LM_PROBE_CACHE: Dict[Tuple[Any, str], Tuple[bool, str, float]] = {}
+
+async def _probe_lm(lm) -> Tuple[bool, str]:
+    """Send a tiny prompt to ``lm``, reusing results younger than PROBE_TTL."""
+    # Keyed on the LM actually called: /env can change METAKEYAI_LLM without
+    # reconfiguring DSPy
+    key = (getattr(lm, "model", None) or id(lm), os.getenv("OPENAI_API_KEY", ""))
+    now = time.monotonic()
+    cached = _LM_PROBE_CACHE.get(key)
+    if cached is not None and now - cached[2] < PROBE_TTL:
+        return cached[0], cached[1]
+
+    try:
+        await asyncio.wait_for(asyncio.to_thread(lm, "ping"), PROBE_TIMEOUT)
+        ok, error = True, ""
+    except asyncio.TimeoutError:
+        ok, error = False, f"LLM probe timed out after {PROBE_TIMEOUT:g}s"
+    except Exception as e:
+        ok, error = False, f"LLM probe failed: {e}"
+    _LM_PROBE_CACHE[key] = (ok, error, now)
+    return ok, error
 
 @app.post("/env")
-def update_env(payload: EnvUpdateRequest):
+async def update_env(payload: EnvUpdateRequest):
+    global _CURRENT_MODEL
     try:
         for k, v in payload.env.items():
             os.environ[str(k)] = str(v)
+        if "METAKEYAI_LLM" in payload.env:
+            _CURRENT_MODEL = payload.env["METAKEYAI_LLM"]
+
+        # First /env (or /quick_edit) loads DSPy with the environment just pushed
+        dspy = await _aget_dspy()
             
-        # Note: DSPy configuration happens ONLY at startup to avoid threading issues
-        # The server needs to be restarted for model changes to take effect
+        # Note: DSPy is configured ONLY once (on first use) to avoid threading issues
+        # The server needs to be restarted for later model changes to take effect
         
         msg = ""
         ok = True
@@ -294,10 +632,22 @@ def update_env(payload: EnvUpdateRequest):
         if dspy:
             # Check if DSPy is already configured (from startup)
             if hasattr(dspy.settings, 'lm') and dspy.settings.lm is not None:
-                current_model = os.getenv("METAKEYAI_LLM", "")
+                current_model = _CURRENT_MODEL or ""
                 if current_model:
                     msg = f"Environment updated. DSPy configured with: {current_model}"
                     ok = True
+                    # A live LLM round-trip is opt-in so routine updates stay in-memory
+                    if payload.probe:
+                        lm_model = getattr(dspy.settings.lm, "model", None)
+                        if lm_model is not None and lm_model != current_model:
+                            # Probing would only test the model DSPy was configured with
+                            msg = (f"Environment updated. DSPy still uses {lm_model} - "
+                                   f"restart server to apply {current_model}.")
+                            ok = False
+                        else:
+                            ok, error = await _probe_lm(dspy.settings.lm)
+                            if not ok:
+                                msg = f"Environment updated. {error}"
                 else:
                     msg = "Environment updated. No METAKEYAI_LLM set."
                     ok = False
@@ -315,12 +665,24 @@ def update_env(payload: EnvUpdateRequest):
 class QuickEditRequest(BaseModel):
     text: str
 
+_QUICK_EDIT_PREDICT: Optional[Any] = None
+_QUICK_EDIT_LM_ID: Optional[int] = None
+
+def _quick_edit_predictor(lm):
+    """Return the quick-edit predictor, rebuilt only when the LM changes."""
+    global _QUICK_EDIT_PREDICT, _QUICK_EDIT_LM_ID
+    if _QUICK_EDIT_PREDICT is None or id(lm) != _QUICK_EDIT_LM_ID:
+        _QUICK_EDIT_PREDICT = dspy.Predict("prompt -> answer")
+        _QUICK_EDIT_LM_ID = id(lm)
+    return _QUICK_EDIT_PREDICT
+
 @app.post("/quick_edit")
-def quick_edit(payload: QuickEditRequest):
+async def quick_edit(payload: QuickEditRequest):
     text = payload.text
     if not text:
         return {"result": "No text provided"}
     
+    dspy = await _aget_dspy()
     if not dspy:
         return {"result": f"DSPy not available: {dspy_error or 'Import failed'}"}
 
@@ -329,8 +691,9 @@ def quick_edit(payload: QuickEditRequest):
         if not hasattr(dspy.settings, 'lm') or dspy.settings.lm is None:
             return {"result": "DSPy LLM not configured"}
             
-        qedit = dspy.Predict("prompt -> answer")
-        improved = qedit(prompt=text).answer
+        qedit = _quick_edit_predictor(dspy.settings.lm)
+        # dspy.Predict is synchronous; keep the LM round-trip off the event loop
+        improved = (await asyncio.to_thread(qedit, prompt=text)).answer
         return {"result": improved.strip()}
     except Exception as e:
         log("quick_edit failed:", e)
@@ -340,6 +703,26 @@ def quick_edit(payload: QuickEditRequest):
 # Main Execution
 # ---------------------------------------------------------------------------
 
+def _server_options() -> Dict[str, Any]:
+    """Prefer uvloop and the httptools parser, falling back when unavailable.
+
+    Both ship with uvicorn[standard]; uvloop has no Windows build. The access
+    log is off because log() already reports to stderr.
+    """
+    def installed(name: str) -> bool:
+        return importlib.util.find_spec(name) is not None
+
+    return {
+        "loop": "uvloop" if sys.platform != "win32" and installed("uvloop") else "asyncio",
+        "http": "httptools" if installed("httptools") else "h11",
+        "access_log": False,
+    }
+
 if __name__ == "__main__":
-    log(f"🚀 Starting FastAPI server on port {PORT}")
-    uvicorn.run(app, host="127.0.0.1", port=PORT) 
\ No newline at end of file
+    log(f"🚀 Starting FastAPI server on port {PORT} ({WORKERS} worker(s))")
+    if WORKERS > 1:
+        # Multiple workers need an import string so each process loads its own app
+        uvicorn.run(f"{Path(__file__).stem}:app", host="127.0.0.1", port=PORT,
+                    workers=WORKERS, **_server_options())
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=PORT, **_server_options()) 
\ No newline at end of file
@@ -1,3 +1,5 @@
+import re
+
 META = {
     "id": "word_count",
     "name": "Word Count",
@@ -6,9 +8,12 @@ META = {
     "category": "text",
 }
 
+_WORD = re.compile(r"\S+")
+
 
 def main(text: str) -> str:
     """Return a simple count summary."""
-    words = len(text.split())
+    # Count matches lazily rather than materialising text.split()
+    words = sum(1 for _ in _WORD.finditer(text))
     chars = len(text)
-    return f"{words} words, {chars} characters" 
\ No newline at end of file
+    return f"{words} words, {chars} characters"